@@ -29,7 +29,7 @@ class BraggRod(object):
 
         self.q = self.structure[0].getRLattice() * self.hkl
         
-        if not self.params.has_key('pdepth'):
+        if 'pdepth' not in self.params:
             self.pdepth = self.structure[0].calcPenetrationDepth(kwargs['alpha'])
     
     def go(self):
@@ -110,7 +110,7 @@ class BraggRod(object):
 
     def _calcCorrections(self):
         self.footprintCorrection = ones(self.q.shape[0])
-        if self.params.has_key('footprint'):
+        if 'footprint' in self.params:
             p = self.params['footprint']
             if p:
                 l = self.structure[0].getLambda() * p[0] / (4 * pi * p[1]) 
@@ -122,7 +122,7 @@ class BraggRod(object):
                 print "Corrected for footprint"
 
         self.lorentzCorrection = ones(self.q.shape[0])
-        if self.params.has_key('lorentz'):
+        if 'lorentz' in self.params:
             if self.params['lorentz']:
                 l = self.structure[0].getLambda()
                 for i in range(self.q.shape[0]):
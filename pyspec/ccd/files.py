@@ -52,16 +52,21 @@ class PrincetonSPEFile():
     DATEMAX = 10
     TIMEMAX = 7
     
-    def __init__(self, fname = None, fid = None):
+    def __init__(self, fname = None, fid = None, mmap = False):
         """Initialize class.
         Parameters:
            fname = Filename of SPE file
            fid = File ID of open stream
+           mmap = If True (and fname is given) memory map the data 
+                  instead of reading it. Only the parts of the array 
+                  which are accessed (e.g. a region of interest) are 
+                  then read from disk.
 
         This function initializes the class and, if either a filename or fid is
         provided opens the datafile and reads the contents"""
         
         self._fid = None
+        self._mmap = mmap and (fname is not None)
         self.fname = fname
         if fname is not None:
             self.openFile(fname)
@@ -247,6 +252,10 @@ class PrincetonSPEFile():
                 self._readAtString(200 + (n * self.TEXTCOMMENTMAX), self.TEXTCOMMENTMAX))
 
     def _readArray(self):
+        if self._mmap:
+            self._array = numpy.memmap(self._fname, dtype = self._dataType, mode = 'r',
+                                       offset = self.DATASTART, shape = self._size)
+            return
         self._fid.seek(self.DATASTART)
         self._array = numpy.fromfile(self._fid, dtype = self._dataType, count = -1)
         self._array = self._array.reshape(self._size)
@@ -29,6 +29,7 @@ import struct
 import numpy as np
 import numpy.ma as ma
 import operator
+from   multiprocessing.pool import ThreadPool
 from   scipy.optimize import leastsq
 import matplotlib.pyplot as plt
 from   pyspec import fit, fitfuncs
@@ -44,6 +45,11 @@ try:
 except:
     pass
 
+try:
+    import numexpr
+except:
+    numexpr = None
+
 try:
     from   pyspec.ccd.files import *
 except:
@@ -122,6 +128,9 @@ class FileProcessor():
 
         self._cropOnRead = None
         self._binOnRead = None
+        self._darkCache = None
+
+        self.nJobs = 1
         
         self.spoolFilename = None
         self.spoolfd = None
@@ -161,8 +170,9 @@ class FileProcessor():
         """
 
         self._cropOnRead = roi
+        self._darkCache = None
 
-    def setCropOnRead(self,bins = None):
+    def setBinOnRead(self, bins = None):
         """Sets the portion of the image to bin on loading each image.
 
         This function will bin the images before loading them into the image processor
@@ -173,6 +183,24 @@ class FileProcessor():
         """
 
         self._binOnRead = bins
+        self._darkCache = None
+
+    def setNumJobs(self, n = 1):
+        """Set the number of threads used to read images from disk
+
+        This only sets the reading of the images. The threads used to 
+        grid the data are set with ImageProcessor.setNumJobs().
+
+        n : int
+           Number of images read in parallel. If n is 1 the images 
+           are read one after the other. Reading in parallel helps when 
+           reading from disk (or network) is the bottleneck.
+        """
+        self.nJobs = n
+
+    def getNumJobs(self):
+        """Get the number of threads used to read images from disk"""
+        return self.nJobs
 
     def setFilenames(self, filenames = None, darkfilenames = None):
         """Set the list of filenames and darkfilenames
@@ -184,6 +212,7 @@ class FileProcessor():
         """
         self.filenames = filenames
         self.darkfilenames = darkfilenames
+        self._darkCache = None
 
     def setMeanMonitor(self, b):
         """Set if the images are normalized by the mean of the monitor
@@ -218,11 +247,11 @@ class FileProcessor():
 
         self.filenames = []
         self.darkfilenames = []
-        self.normData = np.array([])
+        self._darkCache = None
         for s in scan:
             self.filenames += s.ccdFilenames
             self.darkfilenames += s.ccdDarkFilenames
-            self.normData = np.concatenate((self.normData, s.values[mon]))
+        self.normData = np.concatenate([s.values[mon] for s in scan])
 
         # set spool path
 
@@ -317,7 +346,7 @@ class FileProcessor():
         return self.images
 
     def process(self, dark = True, norm = True, 
-                dtype = np.float, quiet = False,
+                dtype = np.float32, quiet = False,
                 crop = False, BG = False,
                 frames = None,
                 keepdark = False):
@@ -328,7 +357,8 @@ class FileProcessor():
         norm  : bool
            If True, normalize by monitor.
         dtype : datatype 
-           numpy datatype of processed array.
+           numpy datatype of processed array. Single precision
+           is sufficient for CCD data and halves the memory used.
         quiet : bool
            If True, dont write to screen when reading images.
         frames : list/int
@@ -338,9 +368,13 @@ class FileProcessor():
            If true keep an array of all dark images. If false
            only store the latest in an array of darkimages"""
    
-        images = []
-        stdevs = []
-        darkstdevs = []
+        images = None
+        stdevs = None
+        darkstdevs = None
+
+        # Only reuse dark images within this call, so darks which
+        # changed on disk are read again
+        self._darkCache = None
 
         if not self.processed:
             self.darkimages = []
@@ -386,12 +420,23 @@ class FileProcessor():
         if type(normIterator) != tuple:
             normIterator = [normIterator]
 
+        # Light images are read through a generator (which can read ahead
+        # in parallel) so make a list of files in the order they are used
+
+        rawNames = []
+        for iname in [self.filenames[i] for i in self.framesToProcess]:
+            if type(iname) == list:
+                rawNames += [_in for _in in iname if os.path.exists(_in)]
+            else:
+                rawNames.append(iname)
+        rawImages = self._readRawImages(rawNames)
+
         # Loop over all frames to process
 
-        for (i, iname, diname, normVal) in zip(self.framesToProcess,
+        for n, (i, iname, diname, normVal) in enumerate(zip(self.framesToProcess,
                                                operator.itemgetter(*self.framesToProcess)(self.filenames), 
                                                operator.itemgetter(*self.framesToProcess)(self.darkfilenames), 
-                                               normIterator):
+                                               normIterator)):
 
             # Store current frame number
 
@@ -407,7 +452,7 @@ class FileProcessor():
                 #Start reading the light images
                 for j, _in in enumerate(iname): 
                     if os.path.exists(_in):
-                        image = self._getRawImage(_in).astype(dtype)
+                        image = next(rawImages).astype(dtype)
                         _images, _stdev = self._binImageWithStdev(_images, _stdev, image)    
                         
                         if not quiet:
@@ -419,18 +464,24 @@ class FileProcessor():
                             sys.stdout.flush()
 
                 if dark:
-                    for j, _din in enumerate(diname):
-                        if os.path.exists(_din):
-                            darkimage =  self._getRawImage(_din).astype(dtype)
-                            _darkimages, _darkstdev = self._binImageWithStdev(_darkimages, _darkstdev, darkimage)
+                    darkkey = self._darkCacheKey(diname, dtype)
+                    if self._darkCache is not None and self._darkCache[0] == darkkey:
+                        # Same dark images as the last frame, use the cache
+                        _darkimages, _darkstdev = self._darkCache[1:]
+                    else:
+                        for j, _din in enumerate(diname):
+                            if os.path.exists(_din):
+                                darkimage =  self._getRawImage(_din).astype(dtype)
+                                _darkimages, _darkstdev = self._binImageWithStdev(_darkimages, _darkstdev, darkimage)
                         
-                            if not quiet:
-                                print "---- Reading dark image %-3d of %-3d (sub image %-3d of %-3d)\r" % (i + 1, len(self.darkfilenames), j + 1, len(diname)),
-                                sys.stdout.flush()
-                            else:
                                 if not quiet:
-                                    print "---- Missing dark image %-3d of %-3d (sub image %-3d of %-3d)\r" % (i + 1, len(self.darkfilenames), j + 1, len(diname)),
+                                    print "---- Reading dark image %-3d of %-3d (sub image %-3d of %-3d)\r" % (i + 1, len(self.darkfilenames), j + 1, len(diname)),
                                     sys.stdout.flush()
+                                else:
+                                    if not quiet:
+                                        print "---- Missing dark image %-3d of %-3d (sub image %-3d of %-3d)\r" % (i + 1, len(self.darkfilenames), j + 1, len(diname)),
+                                        sys.stdout.flush()
+                        self._darkCache = (darkkey, _darkimages, _darkstdev)
 
                 image = _images
                 if _darkimages is not None:
@@ -443,10 +494,19 @@ class FileProcessor():
                 _darkstdev = None
                 _stdev = None
                 # Process only single image pair
-                image = self._getRawImage(iname).astype(dtype)
+                image = next(rawImages).astype(dtype)
 
-                if os.path.exists(diname):
+                darkkey = self._darkCacheKey(diname, dtype)
+                if self._darkCache is not None and self._darkCache[0] == darkkey:
+                    # Same dark image as the last frame, use the cache
+                    darkimage = self._darkCache[1]
+                    if keepdark:
+                        self.darkimages.append(darkimage)
+                    else:
+                        self.darkimages = [darkimage]
+                elif os.path.exists(diname):
                     darkimage =  self._getRawImage(diname).astype(dtype)
+                    self._darkCache = (darkkey, darkimage, None)
                     if keepdark:
                         self.darkimages.append(darkimage)
                     else:
@@ -455,16 +515,28 @@ class FileProcessor():
                 if not quiet:
                     print "---- Reading image %-3d of %-3d\r" % (i, len(self.filenames)),
 
+            if images is None:
+                # The image size is known from the first frame, so 
+                # allocate the whole stack once instead of building 
+                # a list of images and copying it into an array
+                shape = (len(self.framesToProcess),) + image.shape
+                images = np.empty(shape, dtype = image.dtype)
+                stdevs = np.zeros(shape, dtype = image.dtype)
+                darkstdevs = np.zeros(shape, dtype = image.dtype)
+
+            darkVal = None
             if dark:
                 if len(self.darkimages):
-                    image = image - self.darkimages[-1]
+                    darkVal = self.darkimages[-1]
                 else:
                     print "XXXX Unable to dark currect correct. No Image found"
-            
-            if norm:
-                image = image / normVal
 
-            images.append(image)
+            if not norm:
+                normVal = None
+
+            # Correct the image straight into the image stack
+
+            image = self._correctImage(image, darkVal, normVal, images[n])
 
             # Write out the image to the spool file if present
 
@@ -472,22 +544,23 @@ class FileProcessor():
                 self._writeSpoolImage(image)
 
             if _stdev is not None:
-                stdevs.append(np.sqrt(_stdev[1] / _stdev[2]))
-            else:
-                stdevs.append(zeros(image.shape))
+                stdevs[n] = np.sqrt(_stdev[1] / _stdev[2])
 
             if _darkstdev is not None:
-                darkstdevs.append(np.sqrt(_darkstdev[1] / _darkstdev[2]))
-            else:
-                darkstdevs.append(zeros(image.shape))
+                darkstdevs[n] = np.sqrt(_darkstdev[1] / _darkstdev[2])
+
+        if images is None:
+            images = np.array([])
+            stdevs = np.array([])
+            darkstdevs = np.array([])
 
         if not quiet:
             print "\n---- Processed %d images (%d dark images)" % (len(images), len(self.darkimages))
             
         
-        self.images = np.array(images)
-        self.stdevs = np.array(stdevs)
-        self.darkstdevs = np.array(darkstdevs)
+        self.images = images
+        self.stdevs = stdevs
+        self.darkstdevs = darkstdevs
         if not quiet:
             print "---- Done. Array size %s (%.3f Mb)." % (str(self.images.shape), 
                                                            self.images.nbytes / 1024**2) 
@@ -541,11 +614,74 @@ class FileProcessor():
         else:
             return newimage, newstdev
 
+    def _correctImage(self, image, dark, normVal, out):
+        """Dark subtract and normalize image, storing the result in out
+
+        If dark or normVal is None then that correction is skipped.
+        Returns out."""
+        if numexpr is not None and dark is not None and normVal is not None:
+            # Single (multithreaded) pass over the image with numexpr
+            normVal = np.array(normVal, dtype = out.dtype)
+            numexpr.evaluate("(image - dark) / normVal", out = out)
+            return out
+
+        if dark is not None:
+            np.subtract(image, dark, out = out)
+        else:
+            out[...] = image
+        if normVal is not None:
+            out /= normVal
+        return out
+
+    def _darkCacheKey(self, diname, dtype):
+        """Return the key identifying a cached dark image
+
+        The cache is cleared at the start of each call of process()
+        and when the crop, binning or filenames are changed, so only 
+        the filename(s) and dtype are used."""
+        if type(diname) == list:
+            diname = tuple(diname)
+        return (diname, np.dtype(dtype))
+
+    def _readRawImages(self, names):
+        """Generator returning the raw images for the list names (in order)
+
+        If nJobs is larger than 1 then the images are read in batches of
+        nJobs images by a thread pool, with the next batch being read while
+        the current batch is processed."""
+        if self.nJobs <= 1 or len(names) <= 1:
+            for name in names:
+                yield self._getRawImage(name)
+            return
+
+        batches = [names[k:k + self.nJobs] for k in range(0, len(names), self.nJobs)]
+        pool = ThreadPool(self.nJobs)
+        try:
+            result = pool.map_async(self._getRawImage, batches[0])
+            for b in range(len(batches)):
+                images = result.get()
+                if (b + 1) < len(batches):
+                    result = pool.map_async(self._getRawImage, batches[b + 1])
+                for image in images:
+                    yield image
+        finally:
+            pool.close()
+
     def _getRawImage(self, iname):
         """Read raw image"""
         
+        crop = self._cropOnRead
+
         if self._format == 'SPE':
-            img = PrincetonSPEFile(iname).getBinnedData()
+            # When cropping, memory map the file so that only the 
+            # region of interest is read from disk
+            img = PrincetonSPEFile(iname, mmap = crop is not None).getData()
+            if crop is not None:
+                # Crop before binning the frames so that only the 
+                # region of interest is summed (and later cast)
+                img = img[:, crop[0]:crop[2], crop[1]:crop[3]]
+                crop = None
+            img = img.sum(0)
         elif self._format == 'LCLS':
             img = LCLSdataformat(iname)
         elif self._format == 'TIFF':
@@ -553,9 +689,8 @@ class FileProcessor():
         else:
             raise Exception("Unknown file format \"%s\"" % self._format)
 
-        if self._cropOnRead is not None:
-            img = img[self._cropOnRead[0]:self._cropOnRead[2],
-                      self._cropOnRead[1]:self._cropOnRead[3]]
+        if crop is not None:
+            img = img[crop[0]:crop[2], crop[1]:crop[3]]
         if self._binOnRead is not None:
             img = ccdutils.binArray(img, self._binOnRead)
 
@@ -785,6 +920,8 @@ class ImageProcessor():
 
         self._mask = None
 
+        self.nJobs = 1
+
         if fP is not None:
             self.setFileProcessor(fP)
 
@@ -972,10 +1109,11 @@ class ImageProcessor():
         ratY = 1.0*binY/oldBinY
 
         # apply changes to detector probperties
+        # (use integer arithmetic for the no. of pixels)
         self.detPixSizeX *= ratX
         self.detPixSizeY *= ratY
-        self.detSizeX     = int(self.detSizeX / ratX)
-        self.detSizeY     = int(self.detSizeY / ratY)
+        self.detSizeX     = (int(self.detSizeX) * oldBinX) // binX
+        self.detSizeY     = (int(self.detSizeY) * oldBinY) // binY
         self.detX0       /= ratX
         self.detY0       /= ratY
 
@@ -1118,15 +1256,42 @@ class ImageProcessor():
         y = Y[0,0,0]
         z = Z[0,0,0]"""
         
-        grid = np.mgrid[0:self.dQN[0], 0:self.dQN[1], 0:self.dQN[2]]
+        shape = tuple([int(n) for n in self.dQN])
         r = (self.Qmax - self.Qmin) / self.dQN
 
-        X = grid[0] * r[0] + self.Qmin[0]
-        Y = grid[1] * r[1] + self.Qmin[1]
-        Z = grid[2] * r[2] + self.Qmin[2]
-        
+        # Calculate the 1D grid vectors and broadcast them onto the
+        # grid, this avoids the full integer index arrays of mgrid
+
+        x = np.arange(shape[0]) * r[0] + self.Qmin[0]
+        y = np.arange(shape[1]) * r[1] + self.Qmin[1]
+        z = np.arange(shape[2]) * r[2] + self.Qmin[2]
+
+        X = np.empty(shape)
+        Y = np.empty(shape)
+        Z = np.empty(shape)
+        X[...] = x[:, np.newaxis, np.newaxis]
+        Y[...] = y[np.newaxis, :, np.newaxis]
+        Z[...] = z[np.newaxis, np.newaxis, :]
+
         return X, Y, Z
 
+    def setNumJobs(self, n = 1):
+        """Set the number of threads used to grid the data set
+
+        This only sets the gridding of the data. The threads used to 
+        read the images are set with FileProcessor.setNumJobs().
+
+        n : int
+           Number of threads. If n is larger than 1 then processGrid()
+           grids parts of the set in parallel and adds the grids."""
+
+        self.nJobs = n
+
+    def getNumJobs(self):
+        """Get the number of threads used to grid the data set"""
+
+        return self.nJobs
+
     #
     # get set functions for input output
     #
@@ -1181,9 +1346,7 @@ class ImageProcessor():
 
         self.waveLen       = scan[0].wavelength  # in Angstrom
         self.energy        = Diffractometer.hc_over_e / scan[0].wavelength # in eV
-        self.settingAngles = scan[0].getSIXCAngles()
-        for s in scan[1:]:
-            self.settingAngles = np.concatenate((self.settingAngles,s.getSIXCAngles()))
+        self.settingAngles = np.concatenate([s.getSIXCAngles() for s in scan])
         
         self.UBmat         = scan[0].UB
         
@@ -1282,46 +1445,23 @@ class ImageProcessor():
         is set prevously in this class.
 
         """
-        ccdToQkwArgs = {}
         if self.totSet is not None:
-            del self.totSet
+            self.totSet = None
             gc.collect()
 
-        if not self.fileProcessor:
-            raise Exception("No FileProcessor specified.")
-
-        # if images not yet processed, do it
-        if getattr(self.fileProcessor, 'images', None) is None:
-            self.fileProcessor.process()
-
-        if self.settingAngles is None:
-            raise Exception("No setting angles specified.")
+        self._prepareImages()
 
         print "\n"
         print "---- Setting angle size :", self.settingAngles.shape
         print "---- CCD Size :", (self.detSizeX, self.detSizeY)
         print "**** Converting to Q"
         t1 = time.time()
-        self.totSet = ctrans.ccdToQ(angles      = self.settingAngles * np.pi / 180.0, 
-                                    mode        = self.frameMode,
-                                    ccd_size    = (self.detSizeX, self.detSizeY),
-                                    ccd_pixsize = (self.detPixSizeX, self.detPixSizeY),
-                                    ccd_cen     = (self.detX0, self.detY0),
-                                    dist        = self.detDis,
-                                    wavelength  = self.waveLen,
-                                    UBinv       = np.matrix(self.UBmat).I,
-                                    **ccdToQkwArgs)
+        self.totSet = self._ccdToQ(self.settingAngles)
         t2 = time.time()
         print "---- DONE (Processed in %f seconds)" % (t2 - t1)
         print "---- Setsize is %d" % self.totSet.shape[0]
         self.totSet[:,3] = np.ravel(self.fileProcessor.getImage())  
        
-        if self.detMask is None:
-            m = self.fileProcessor.getMask()
-            if m is not None:
-                if m.sum():
-                    self.detMask = m 
-
         if self.detMask is not None:
             print "---- Masking data"
             totMask = self.detMask.ravel()
@@ -1339,41 +1479,214 @@ class ImageProcessor():
         """Process imageset of (Qx, Qy, Qz, I) into grid 
 
         This function, process the set of (Qx, Qy, Qz, I) values and grid the data."""
-        print "---- Total data is %f MBytes\n" % (self.totSet.nbytes / 1024.0**2)
-        
         if self.totSet is None:
             raise Exception("No set of (Qx, Qy, Qz, I). Cannot process grid.")
 
+        print "---- Total data is %f MBytes\n" % (self.totSet.nbytes / 1024.0**2)
+
         # prepare min, max,... from defaults if not set
         if self.Qmin is None:
             self.Qmin = np.array([ self.totSet[:,0].min(), self.totSet[:,1].min(), self.totSet[:,2].min() ])
         if self.Qmax is None:
             self.Qmax = np.array([ self.totSet[:,0].max(), self.totSet[:,1].max(), self.totSet[:,2].max() ])
-        if self.dQN is None:
-            self.dQN = [100, 100, 100]
+        self._setDefaultGridSize()
 
         # 3D grid of the data set 
         print "**** Gridding Data."
         t1 = time.time()
-        gridData, gridOccu, gridStdErr, gridOut = ctrans.grid3d(self.totSet, self.Qmin, self.Qmax, self.dQN, norm = 1)
+        if self.nJobs > 1:
+            # gridsums3d releases the GIL, so grid one part of the set 
+            # per thread and add the grids (in order, to get the same 
+            # result for each run)
+            sums = None
+            pool = ThreadPool(self.nJobs)
+            try:
+                for part in pool.imap(self._gridSums, 
+                                      np.array_split(self.totSet, self.nJobs)):
+                    sums = self._addGridSums(sums, part)
+            finally:
+                pool.close()
+            gridData, gridOccu, gridStdErr, gridOut = self._gridFromSums(sums)
+        else:
+            gridData, gridOccu, gridStdErr, gridOut = ctrans.grid3d(self.totSet, self.Qmin, self.Qmax, self.dQN, norm = 1)
         t2 = time.time()
         print "---- DONE (Processed in %f seconds)" % (t2 - t1)
+
+        self._setGrid(gridData, gridOccu, gridStdErr, gridOut)
+
+    def processAndGrid(self, chunkSize = None):
+        """Process the images into (Qx, Qy, Qz, I) and grid them in chunks
+
+        This performs the same processing as process(), but the full set 
+        of (Qx, Qy, Qz, I) is never stored. Instead chunkSize images at a 
+        time are converted to Q and added to the grid. Only the memory of 
+        the set is saved, the images of the FileProcessor are still
+        processed and held in memory.
+
+        As the limits can not be taken from the full set, the grid
+        limits (Qmin and Qmax) must be set with setGridSize() first.
+
+        chunkSize : int
+           Number of images to convert and grid at a time. If None, the
+           chunk is sized to use about 256 MBytes for (Qx, Qy, Qz, I)."""
+
+        if self.Qmin is None or self.Qmax is None:
+            raise Exception("Qmin and Qmax must be set (see setGridSize()) to grid in chunks.")
+        self._setDefaultGridSize()
+
+        if self.totSet is not None:
+            self.totSet = None
+            gc.collect()
+
+        self._prepareImages()
+
+        images = self.fileProcessor.getImage()
+        nimages = self.settingAngles.shape[0]
+        npixels = self.detSizeX * self.detSizeY
+
+        if chunkSize is None:
+            chunkSize = max(1, (256 * 1024**2) // (npixels * 4 * 8))
+        chunkSize = min(chunkSize, nimages)
+
+        print "\n"
+        print "---- Setting angle size :", self.settingAngles.shape
+        print "---- CCD Size :", (self.detSizeX, self.detSizeY)
+        print "**** Converting to Q and gridding data (%d images at a time)." % chunkSize
+        t1 = time.time()
+
+        sums = None
+        qOut = np.empty((chunkSize * npixels, 4))
+        for start in range(0, nimages, chunkSize):
+            stop = min(start + chunkSize, nimages)
+            data = self._ccdToQ(self.settingAngles[start:stop], 
+                                outarray = qOut[:(stop - start) * npixels])
+            data[:,3] = np.ravel(images[start:stop])
+
+            if self.detMask is not None:
+                if self.detMask.ndim == 2:
+                    mask = np.tile(self.detMask.ravel(), stop - start)
+                else:
+                    mask = self.detMask[start:stop].ravel()
+                data = data[mask == False,:]
+
+            sums = self._gridSums(data, sums)
+            del data
+
+        t2 = time.time()
+        print "---- DONE (Processed in %f seconds)" % (t2 - t1)
+
+        self._setGrid(*self._gridFromSums(sums))
+
+    def makeGridData(self, *args, **kwargs):
+        """Convinience to call makeGrid"""
+        self.process(*args, **kwargs)
+
+    def _prepareImages(self):
+        """Check the input and process the images for the conversion to Q
+
+        The images of the FileProcessor are processed if not done yet and
+        the detector mask is taken from the FileProcessor if not set."""
+
+        if not self.fileProcessor:
+            raise Exception("No FileProcessor specified.")
+
+        # if images not yet processed, do it
+        if getattr(self.fileProcessor, 'images', None) is None:
+            self.fileProcessor.process()
+
+        if self.settingAngles is None:
+            raise Exception("No setting angles specified.")
+
+        if self.detMask is None:
+            m = self.fileProcessor.getMask()
+            if m is not None:
+                if m.sum():
+                    self.detMask = m 
+
+    def _setDefaultGridSize(self):
+        """Set the default number of voxels if not set"""
+        if self.dQN is None:
+            self.dQN = [100, 100, 100]
+
+    def _ccdToQ(self, angles, **kwargs):
+        """Convert all CCD pixels to (Qx, Qy, Qz) for the setting angles
+
+        angles : ndarray
+           Setting angles (in degrees) of the images to convert.
+
+        Other keyword arguments are passed to ctrans.ccdToQ"""
+
+        return ctrans.ccdToQ(angles      = angles * np.pi / 180.0, 
+                             mode        = self.frameMode,
+                             ccd_size    = (self.detSizeX, self.detSizeY),
+                             ccd_pixsize = (self.detPixSizeX, self.detPixSizeY),
+                             ccd_cen     = (self.detX0, self.detY0),
+                             dist        = self.detDis,
+                             wavelength  = self.waveLen,
+                             UBinv       = np.matrix(self.UBmat).I,
+                             **kwargs)
+
+    def _gridSums(self, data, sums = None):
+        """Grid the set data adding the sums over each voxel to sums
+
+        Sums is a list of the intensity sum, sum of the squared intensity,
+        occupation and number of points outside the grid. If sums is None,
+        new sums are returned. Sums of different parts of a data set can 
+        be added (see _addGridSums())."""
+
+        if sums is None:
+            sums = [np.zeros(self.dQN), np.zeros(self.dQN), 
+                    np.zeros(self.dQN, dtype = np.uint), 0]
+
+        sums[3] += ctrans.gridsums3d(data, self.Qmin, self.Qmax, self.dQN,
+                                     sums[0], sums[1], sums[2])
+
+        return sums
+
+    def _addGridSums(self, sums, new):
+        """Add the grid sums new to sums (in place)"""
+        if sums is None:
+            return new
+        for i in range(4):
+            sums[i] += new[i]
+        return sums
+
+    def _gridFromSums(self, sums):
+        """Calculate the grid from the sums of _gridSums()
+
+        Returns a tuple of the mean intensity, occupation, standard 
+        error and number of points outside the grid (as ctrans.grid3d)"""
+
+        gridSum, gridSumSq, gridOccu, gridOut = sums
+        n = gridOccu.astype(np.float)
+        filled = gridOccu > 0
+        multi = gridOccu > 1
+
+        gridData = np.zeros(gridSum.shape)
+        gridData[filled] = gridSum[filled] / n[filled]
+
+        # sample variance of each voxel from the sums
+        gridStdErr = np.zeros(gridSum.shape)
+        var = (gridSumSq[multi] - gridSum[multi] * gridData[multi]) / (n[multi] - 1)
+        gridStdErr[multi] = np.sqrt(np.clip(var, 0, np.inf) / n[multi])
+
+        return gridData, gridOccu, gridStdErr, gridOut
+
+    def _setGrid(self, gridData, gridOccu, gridStdErr, gridOut):
+        """Store the grid, printing warnings on the grid occupation"""
+
         emptNb = (gridOccu == 0).sum()
         if gridOut != 0:
             print "---- Warning : There are %.2e points outside the grid (%.2e bins in the grid)" % (gridOut, gridData.size)
         if emptNb:
             print "---- Warning : There are %.2e values zero in the grid" % emptNb
 
-       # store intensity, occupation and no. of outside data points of the grid
+        # store intensity, occupation and no. of outside data points of the grid
         self.gridData   = gridData
         self.gridOccu   = gridOccu
         self.gridOut    = gridOut
         self.gridStdErr = gridStdErr
 
-    def makeGridData(self, *args, **kwargs):
-        """Convinience to call makeGrid"""
-        self.process(*args, **kwargs)
-
 
 ##################################################################################################################
 ##                                                                                                              ##
@@ -1430,7 +1743,7 @@ class CCDParamsConfigParser(ConfigParser):
         if not os.path.isfile(filename):
             locations = []
             if os.name is 'posix':
-                if os.environ.has_key('HOME'):
+                if 'HOME' in os.environ:
                     locations.append(os.environ['HOME'] + os.path.sep + ".pyspec")
                 locations.append('/usr/local/pyspec/etc')
                 locations.append('/etc/pyspec')
@@ -25,12 +25,11 @@ import numpy as np
 def binArray(a, bins):
     """Bin 2D array
 
-    Bin 
+    Sum the 2D array a over blocks of (bins[0] x bins[1]) elements.
     """
-    if (a.size[0] % bins[0]):
+    if (a.shape[0] % bins[0]):
         raise Exception("To apply bin data x dimension should be divisible by no of bins")
-    if (a.size[1] % bins[1]):
+    if (a.shape[1] % bins[1]):
         raise Exception("To apply bin data y dimension should be divisible by no of bins")
-    a = a.resize((img.size[0],-1,self._binOnRead[0])).sum(2)
-    a = a.resize((-1, self._binOnRead[1], img.size[1])).sum(1)
-    return a
+    a = a.reshape(a.shape[0] // bins[0], bins[0], a.shape[1] // bins[1], bins[1])
+    return a.sum(3).sum(1)
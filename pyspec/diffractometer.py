@@ -218,7 +218,9 @@ class Diffractometer():
 
         QHKL = UB^-1 sixcToFourc^T QPhi"""
  
-        return ( self.UBinv * np.dot( self.sixcToFourc.T, self.getQPhi().T )  ).T
+        # combine the constant matrices first, so only one
+        # matrix product is performed over all Q values
+        return ( (self.UBinv * self.sixcToFourc.T) * self.getQPhi().T ).T
 
 
 
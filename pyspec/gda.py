@@ -170,7 +170,7 @@ class gdaData:
 		self.values[key] = data
 	
 	def get(self, key):
-		if self.values.has_key(key):
+		if key in self.values:
 			return self.values[key]
 		else:
 			return None
@@ -16,9 +16,9 @@ def printfig(*args, **kwargs):
   specifying the keyword argument printer = 'name' will send to a printer which is not
   the system default. """
 
-  if kwargs.has_key['printer']:
-    printer = '-d' + kwargs['printer']
-    del kwargs['printer']
+  printer = kwargs.pop('printer', None)
+  if printer is not None:
+    printer = '-d' + printer
   else:
     printer = ''
 
@@ -80,7 +80,7 @@ class AnnoteFinder:
     """
     Draw the annotation on the plot
     """
-    if self.drawnAnnotations.has_key((x,y)):
+    if (x,y) in self.drawnAnnotations:
       markers = self.drawnAnnotations[(x,y)]
       for m in markers:
         m.set_visible(not m.get_visible())
@@ -329,14 +329,14 @@ class SpecDataFile:
     def _moveto(self, item):
         """Move to a location in the datafile for scan"""
 
-        if self.findex.has_key(item):
+        if item in self.findex:
             self.file.seek(self.findex[item])
         else:
             # Try re-indexing the file here.
             if __verbose__:
                 print "**** Re-indexing scan file\n"
             self.index()
-            if self.findex.has_key(item):
+            if item in self.findex:
                 self.file.seek(self.findex[item])
             else:
                 raise Exception("Scan %s is not in datafile ....." % item)
@@ -416,7 +416,7 @@ class SpecDataFile:
             # Check if scan is in datafile
             
                     
-            if (self.scandata.has_key(i) is False) or (reread is True):
+            if (i not in self.scandata) or (reread is True):
                 self._moveto(i)
                 self.scandata[i] = SpecScan(self, i, setkeys, mask = m, **kwargs)
 
@@ -782,7 +782,7 @@ class SpecScan:
         typestoprint = [float, str, numpy.ndarray, int, numpy.float64]
         
         for d in self.__dict__:
-            if not self.scandata.values.has_key(d):
+            if d not in self.scandata.values:
                 if typestoprint.count(type(getattr(self, d))):
                     p = p + "%-19s " % d
                     print d, type(getattr(self, d))
@@ -827,7 +827,7 @@ class SpecData:
             print "oooo Setting key %s" % key
 
     def get(self, key):
-        if self.values.has_key(key):
+        if key in self.values:
             return self.values[key]
         else:
             return None
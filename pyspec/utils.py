@@ -23,7 +23,10 @@
 from __future__ import with_statement
 import pylab as pl
 import numpy as np
-import pickle 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import pyspec
 import os
 from matplotlib.ticker import MultipleLocator, MaxNLocator, FormatStrFormatter
@@ -69,22 +72,16 @@ def printAll(fname = "Plot", hc = False, small = True, lpcommand = 'lp'):
             os.system('%s %s%03d.ps' % (lpcommand, fname, x))
 
 def multifit(sf, scans, var, *args, **kwargs):
-    alldata = np.array([])
-    allerrors = np.array([])
+    alldata = None
+    allerrors = None
     pl.figure(figsize=(8.5, 11))
 
     firstrun = True
     plotnum = 1
 
-    npp = kwargs.get('npp', (6, 2));
-    if kwargs.has_key('npp'):
-        del kwargs['bgnd']
-    bgnd = kwargs.get('bgnd', None);
-    if kwargs.has_key('npp'):
-        del kwargs['bgnd']
-    guessfollow = kwargs.get('guessfollow', False);
-    if kwargs.has_key('guessfollow'):
-        del kwargs['guessfollow']
+    npp = kwargs.pop('npp', (6, 2))
+    bgnd = kwargs.pop('bgnd', None)
+    guessfollow = kwargs.pop('guessfollow', False)
 
     if type(var) == tuple:
         xvar = var[0]
@@ -105,7 +102,7 @@ def multifit(sf, scans, var, *args, **kwargs):
         mvar = None
         yvar = None
 
-    for scan in scans:
+    for k, scan in enumerate(scans):
         pl.subplot(npp[0], npp[1], plotnum)
 
         sf[scan].plot(new = False, notitles = True, xcol = pvar, ycol = yvar,mcol = mvar)
@@ -120,10 +117,17 @@ def multifit(sf, scans, var, *args, **kwargs):
                 kwargs['guess'] = f.result
             f = pyspec.fit.fitdata(*args, **kwargs)
 
-        exec '_xvar = sf[scan].%s' % var[0] 
+        _xvar = getattr(sf[scan], xvar)
 
-        alldata = np.concatenate((alldata, np.array([np.mean(_xvar)]), f.result))
-        allerrors = np.concatenate((allerrors, np.array([np.std(_xvar)]), f.stdev))
+        if alldata is None:
+            # The number of parameters is known after the first fit
+            alldata = np.empty((len(scans), len(f.result) + 1))
+            allerrors = np.empty(alldata.shape)
+
+        alldata[k,0] = np.mean(_xvar)
+        alldata[k,1:] = f.result
+        allerrors[k,0] = np.std(_xvar)
+        allerrors[k,1:] = f.stdev
 
         pl.title('[%s] %f +- %f' % (scan, np.mean(_xvar), np.std(_xvar)))
 
@@ -132,9 +136,6 @@ def multifit(sf, scans, var, *args, **kwargs):
             plotnum = 1
         else:
             plotnum += 1
-            
-    alldata = alldata.reshape(-1, len(f.result)+1)
-    allerrors = allerrors.reshape(-1, len(f.result)+1)
 
     return alldata, allerrors
 
@@ -160,8 +161,6 @@ def pickleit(filename, *args):
 
     """
 
-    output = open(filename, 'wb')
-
     if len(args) == 1:
         if type(args[0]) != list:
             pobject = [args[0]]
@@ -170,11 +169,13 @@ def pickleit(filename, *args):
     else:
         pobject = list(args)
 
-    for o in pobject:
-        pickle.dump(o, output)
+    # Use the (fast) binary protocol, each object is still pickled
+    # separately so files can be read by unpickleit as before
+    with open(filename, 'wb') as output:
+        for o in pobject:
+            pickle.dump(o, output, pickle.HIGHEST_PROTOCOL)
 
     print "**** Pickled %d objects to %s" % (len(pobject), filename)
-    output.close()
 
 def unpickleit(filename):
     """Unpickle a python object (created with pickleit)
@@ -327,20 +328,16 @@ def makeNicePlot(ax, xint = 5, yint = 5, mxint = 4, myint = 4,
 
 def setImageRange(data, limits, bins = 100):
     
-    h,b = np.histogram(data, bins = bins)
-    b = np.arange(data.min(), data.max(), 
-                  (data.max() - data.min()) / bins)
-    com = (h * np.arange(h.size)).sum() /  h.sum()
+    # Use the bin edges of the histogram rather than recalculating them
+    dmin, dmax = data.min(), data.max()
+    h,b = np.histogram(data, bins = bins, range = (dmin, dmax))
+    com = np.average(np.arange(h.size), weights = h)
     limits = (np.array(limits) / 100.0) * bins
 
-    if (com - limits[0]) < 0:
-        dmin = data.min()
-    else:
+    if (com - limits[0]) >= 0:
         dmin = b[int(com - limits[0])]
     
-    if (com + limits[1]) >= bins:
-        dmax = data.max()
-    else:
+    if (com + limits[1]) < bins:
         dmax = b[int(com + limits[1])]
 
     return dmin, dmax
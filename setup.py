@@ -42,7 +42,7 @@ doclines = __doc__.split("\n")
 if sys.version_info < (2, 3):
     _setup = setup
     def setup(**kwargs):
-        if kwargs.has_key("classifiers"):
+        if "classifiers" in kwargs:
             del kwargs["classifiers"]
         _setup(**kwargs)
 
@@ -60,6 +60,9 @@ static PyObject* ccdToQ(PyObject *self, PyObject *args, PyObject *kwargs){
 #endif
   imageThreadData threadData[NTHREADS];
 
+  ccd.delOffset = NULL;
+  ccd.gamOffset = NULL;
+
   if(!PyArg_ParseTupleAndKeywords(args, kwargs, "Oi(ii)(dd)(dd)ddO|O", kwlist,
 				  &_angles,
 				  &mode,
@@ -96,6 +99,13 @@ static PyObject* ccdToQ(PyObject *self, PyObject *args, PyObject *kwargs){
   nimages = PyArray_DIM(angles, 0);
   ndelgam = ccd.xSize * ccd.ySize;
 
+  // The pixel offsets only depend on the CCD geometry so 
+  // calculate them once for all images
+  if(!calcDeltaGammaOffsets(&ccd)){
+    PyErr_NoMemory();
+    goto cleanup;
+  }
+
   dims[0] = nimages * ndelgam;
   dims[1] = 4;
   if(!_outarray){
@@ -119,6 +129,9 @@ static PyObject* ccdToQ(PyObject *self, PyObject *args, PyObject *kwargs){
   anglesp = (_float *)PyArray_DATA(angles);
   qOutp = (_float *)PyArray_DATA(qOut);
 
+  // The conversion does not use python objects, so release the GIL
+  Py_BEGIN_ALLOW_THREADS
+
   stride = nimages / NTHREADS;
   for(t=0;t<NTHREADS;t++){
     // Setup threads
@@ -161,11 +174,17 @@ static PyObject* ccdToQ(PyObject *self, PyObject *args, PyObject *kwargs){
   }
 #endif
 
+  Py_END_ALLOW_THREADS
+
+  free(ccd.delOffset);
+  free(ccd.gamOffset);
   Py_XDECREF(ubinv);
   Py_XDECREF(angles);
   return Py_BuildValue("N", qOut);
 
  cleanup:
+  free(ccd.delOffset);
+  free(ccd.gamOffset);
   Py_XDECREF(ubinv);
   Py_XDECREF(angles);
   Py_XDECREF(qOut);
@@ -175,74 +194,95 @@ static PyObject* ccdToQ(PyObject *self, PyObject *args, PyObject *kwargs){
 void *processImageThread(void* ptr){
   imageThreadData *data;
   int i;
-  _float *delgam;
+  _float *work;
   data = (imageThreadData*) ptr;
-  delgam = (_float*)malloc(data->ndelgam * sizeof(_float) * 2);
-  if(!delgam){
+  // Work space for the per row and per column trig values
+  work = (_float*)malloc((data->ccd->xSize + data->ccd->ySize) * sizeof(_float) * 2);
+  if(!work){
     fprintf(stderr, "MALLOC ERROR\n");
 #ifdef USE_THREADS
     pthread_exit(NULL);
 #endif
+    return NULL;
   }
   
   for(i=data->imstart;i<data->imend;i++){
     // For each image process
-    calcDeltaGamma(delgam, data->ccd, data->anglesp[0], data->anglesp[5]);
-    calcQTheta(delgam, data->anglesp[1], data->anglesp[4], data->qOutp, 
-	       data->ndelgam, data->lambda);
-    if(data->mode > 1){
+    calcQTheta(data->ccd, data->anglesp[0], data->anglesp[5], 
+	       data->anglesp[1], data->anglesp[4], data->qOutp, 
+	       data->lambda, work);
+    if(data->mode == 4){
+      calcHKLFromQTheta(data->qOutp, data->ndelgam, 
+			data->anglesp[2], data->anglesp[3], data->UBI);
+    } else if(data->mode > 1){
       calcQPhiFromQTheta(data->qOutp, data->ndelgam, 
 			 data->anglesp[2], data->anglesp[3]);
     }
-    if(data->mode == 4){
-      calcHKLFromQPhi(data->qOutp, data->ndelgam, data->UBI);
-    }
     data->anglesp+=6;
     data->qOutp+=(data->ndelgam * 4); 
   }
-  free(delgam);
+  free(work);
 #ifdef USE_THREADS
   pthread_exit(NULL);
 #endif
+  return NULL;
 }
 
-int calcQTheta(_float* diffAngles, _float theta, _float mu, _float *qTheta, _int n, _float lambda){
-  // Calculate Q in the Theta frame
-  // angles -> Six cicle detector angles [delta gamma]
+int calcQTheta(CCD *ccd, _float delCen, _float gamCen, _float theta, _float mu, 
+	       _float *qTheta, _float lambda, _float *work){
+  // Calculate Q in the Theta frame for all pixels of the CCD
+  // delCen -> Delta value at this detector setting
+  // gamCen -> Gamma value at this detector setting
   // theta  -> Theta value at this detector setting
   // mu     -> Mu value at this detector setting
   // qTheta -> Q Values
-  // n      -> Number of values to convert
-  _int i;
-  _float *angles;
+  // work   -> Work space of 2 * (xSize + ySize) values
+  //
+  // Delta only depends on the row and gamma only on the column of 
+  // the pixel, so the trig functions are evaluated once per row and 
+  // once per column. The incident wavevector is the same for all pixels.
+  _int i, j;
   _float *qt;
-  _float kl;
-  _float del, gam;
+  _float kl, kix, kiy, kiz;
+  _float *sinGam, *cosGam, *sinDel, *cosDel;
+
+  sinGam = work;
+  cosGam = sinGam + ccd->xSize;
+  sinDel = cosGam + ccd->xSize;
+  cosDel = sinDel + ccd->ySize;
 
-  angles = diffAngles;
-  qt = qTheta;
   kl = 2 * M_PI / lambda;
-  for(i=0;i<n;i++){
-    del = *(angles++);
-    gam = *(angles++);
-    *qt = (-1.0 * sin(gam) * kl) - (sin(mu) * kl);
- 
-    qt++;
-    *qt = (cos(del - theta) * cos(gam) * kl) - (cos(theta) * cos(mu) * kl);
- 
-    qt++;
-    *qt = (sin(del - theta) * cos(gam) * kl) + (sin(theta) * cos(mu) * kl);
- 
-    qt++;
-    qt++;
+  kix = sin(mu) * kl;
+  kiy = cos(theta) * cos(mu) * kl;
+  kiz = sin(theta) * cos(mu) * kl;
+
+  for(i=0;i<ccd->xSize;i++){
+    sinGam[i] = sin(gamCen - ccd->gamOffset[i]) * kl;
+    cosGam[i] = cos(gamCen - ccd->gamOffset[i]);
+  }
+  for(j=0;j<ccd->ySize;j++){
+    sinDel[j] = sin(delCen - ccd->delOffset[j] - theta) * kl;
+    cosDel[j] = cos(delCen - ccd->delOffset[j] - theta) * kl;
+  }
+
+  qt = qTheta;
+  for(j=0;j<ccd->ySize;j++){
+    for(i=0;i<ccd->xSize;i++){
+      *qt = -1.0 * sinGam[i] - kix;
+      qt++;
+      *qt = cosDel[j] * cosGam[i] - kiy;
+      qt++;
+      *qt = sinDel[j] * cosGam[i] + kiz;
+      qt++;
+      qt++;
+    }
   }
   
   return true;
 }
 
-int calcQPhiFromQTheta(_float *qTheta, _int n, _float chi, _float phi){
-  _float r[3][3];
-
+int calcPhiRotation(_float r[][3], _float chi, _float phi){
+  // Rotation matrix from the theta frame to the phi frame
   r[0][0] = cos(chi);
   r[0][1] = 0.0;
   r[0][2] = -1.0 * sin(chi);
@@ -253,13 +293,36 @@ int calcQPhiFromQTheta(_float *qTheta, _int n, _float chi, _float phi){
   r[2][1] = -1.0 * sin(phi);
   r[2][2] = cos(phi) * cos(chi);
 
+  return true;
+}
+
+int calcQPhiFromQTheta(_float *qTheta, _int n, _float chi, _float phi){
+  _float r[3][3];
+
+  calcPhiRotation(r, chi, phi);
   matmulti(qTheta, n, r, 1);
   
   return true;
 }
 
-int calcHKLFromQPhi(_float *qPhi, _int n, _float mat[][3]){
-  matmulti(qPhi, n, mat, 1);
+int calcHKLFromQTheta(_float *qTheta, _int n, _float chi, _float phi, _float mat[][3]){
+  // The rotation to the phi frame and the UB matrix are the same 
+  // for all pixels, so combine them and apply one matrix per pixel
+  _float r[3][3];
+  _float m[3][3];
+  int i,j,k;
+
+  calcPhiRotation(r, chi, phi);
+  for(i=0;i<3;i++){
+    for(j=0;j<3;j++){
+      m[i][j] = 0.0;
+      for(k=0;k<3;k++){
+	m[i][j] += mat[i][k] * r[k][j];
+      }
+    }
+  }
+  matmulti(qTheta, n, m, 1);
+
   return true;
 }
 
@@ -287,25 +350,33 @@ int matmulti(_float *val, int n, _float mat[][3], int skip){
   return true;
 }
 
-int calcDeltaGamma(_float *delgam, CCD *ccd, _float delCen, _float gamCen){
-  // Calculate Delta Gamma Values for CCD
-  int i,j;
-  _float *delgamp;
+int calcDeltaGammaOffsets(CCD *ccd){
+  // Calculate the delta offset of each row and the gamma 
+  // offset of each column of the CCD
+  //
+  // atan() is only called (xSize + ySize) times per call of ccdToQ,
+  // so the exact libm version is used rather than an approximation.
+  int i;
   _float xPix, yPix;
 
+  ccd->delOffset = (_float*)malloc(ccd->ySize * sizeof(_float));
+  ccd->gamOffset = (_float*)malloc(ccd->xSize * sizeof(_float));
+  if(!ccd->delOffset || !ccd->gamOffset){
+    return false;
+  }
+
   xPix = ccd->xPixSize / ccd->dist;
   yPix = ccd->yPixSize / ccd->dist;
-  delgamp = delgam;
 
-  for(j=0;j<ccd->ySize;j++){
-    for(i=0;i<ccd->xSize;i++){
-      *(delgamp++) = delCen - atan( ((_float)j - ccd->yCen) * yPix);
-      *(delgamp++) = gamCen - atan( ((_float)i - ccd->xCen) * xPix); 
-    }
+  for(i=0;i<ccd->ySize;i++){
+    ccd->delOffset[i] = atan(((_float)i - ccd->yCen) * yPix);
+  }
+  for(i=0;i<ccd->xSize;i++){
+    ccd->gamOffset[i] = atan(((_float)i - ccd->xCen) * xPix);
   }
 
   return true;
-} 
+}
 
 static PyObject* gridder_3D(PyObject *self, PyObject *args, PyObject *kwargs){
   PyObject *gridout = NULL, *Nout = NULL, *standarderror = NULL;
@@ -357,9 +428,13 @@ static PyObject* gridder_3D(PyObject *self, PyObject *args, PyObject *kwargs){
     goto cleanup;
   }
   
+  // No python objects are used while gridding, so release 
+  // the GIL to allow other python threads to run (or grid)
+  Py_BEGIN_ALLOW_THREADS
   n_outside = c_grid3d(PyArray_DATA(gridout), PyArray_DATA(Nout), 
 		       PyArray_DATA(standarderror), PyArray_DATA(gridI),
 		       grid_start, grid_stop, data_size, grid_nsteps, norm_data);
+  Py_END_ALLOW_THREADS
   
   Py_XDECREF(gridI);
   return Py_BuildValue("NNNl", gridout, Nout, standarderror, n_outside); 
@@ -372,6 +447,73 @@ static PyObject* gridder_3D(PyObject *self, PyObject *args, PyObject *kwargs){
   return NULL;
 }
 
+static PyObject* gridder_3D_sums(PyObject *self, PyObject *args, PyObject *kwargs){
+  PyObject *gridI = NULL;
+  PyObject *_I, *gridsum, *gridsumsq, *Nout;
+  
+  static char *kwlist[] = { "data", "xrange", "yrange", "zrange", 
+			    "gridsum", "gridsumsq", "occu", NULL };
+  
+  npy_intp data_size;
+  npy_intp grid_size;
+  
+  double grid_start[3];
+  double grid_stop[3];
+  int grid_nsteps[3];
+  
+  unsigned long n_outside;
+  
+  if(!PyArg_ParseTupleAndKeywords(args, kwargs, "O(ddd)(ddd)(iii)O!O!O!", kwlist,
+				  &_I, 
+				  &grid_start[0], &grid_start[1], &grid_start[2],
+				  &grid_stop[0], &grid_stop[1], &grid_stop[2],
+				  &grid_nsteps[0], &grid_nsteps[1], &grid_nsteps[2],
+				  &PyArray_Type, &gridsum, &PyArray_Type, &gridsumsq,
+				  &PyArray_Type, &Nout)){
+    return NULL;
+  }	
+
+  // The grids are added to in place, so they must be contiguous arrays 
+  // of the right type and size
+  
+  grid_size = grid_nsteps[0] * grid_nsteps[1] * grid_nsteps[2];
+  if((PyArray_TYPE(gridsum) != NPY_DOUBLE) || !PyArray_ISCARRAY(gridsum) ||
+     (PyArray_Size(gridsum) != grid_size) ||
+     (PyArray_TYPE(gridsumsq) != NPY_DOUBLE) || !PyArray_ISCARRAY(gridsumsq) ||
+     (PyArray_Size(gridsumsq) != grid_size)){
+    PyErr_SetString(PyExc_ValueError, "gridsum and gridsumsq must be contiguous arrays of doubles of the grid size");
+    return NULL;
+  }
+  if((PyArray_TYPE(Nout) != NPY_ULONG) || !PyArray_ISCARRAY(Nout) ||
+     (PyArray_Size(Nout) != grid_size)){
+    PyErr_SetString(PyExc_ValueError, "occu must be a contiguous array of unsigned longs of the grid size");
+    return NULL;
+  }
+  
+  gridI = PyArray_FROMANY(_I, NPY_DOUBLE, 2, 2, NPY_IN_ARRAY);
+  if(!gridI){
+    PyErr_SetString(PyExc_ValueError, "data must be a 2-D array of floats");
+    return NULL;
+  }
+  if(PyArray_DIM(gridI, 1) != 4){
+    PyErr_SetString(PyExc_ValueError, "data must be an array of (Qx, Qy, Qz, I) rows");
+    Py_XDECREF(gridI);
+    return NULL;
+  }
+  
+  data_size = PyArray_DIM(gridI, 0);
+  
+  /* GIL released, see gridder_3D */
+  Py_BEGIN_ALLOW_THREADS
+  n_outside = c_gridsums3d(PyArray_DATA(gridsum), PyArray_DATA(gridsumsq), 
+			   PyArray_DATA(Nout), PyArray_DATA(gridI),
+			   grid_start, grid_stop, data_size, grid_nsteps);
+  Py_END_ALLOW_THREADS
+  
+  Py_XDECREF(gridI);
+  return Py_BuildValue("l", n_outside); 
+}
+
 unsigned long c_grid3d(double *dout, unsigned long *nout, double *standarderror, double *data, 
 		       double *grid_start, double *grid_stop, int max_data, 
 		       int *n_grid, int norm_data){
@@ -402,7 +544,8 @@ unsigned long c_grid3d(double *dout, unsigned long *nout, double *standarderror,
       return n_outside;
     }
     Qk = (double*)malloc(sizeof(double) * grid_size);
-    if(!Mk){
+    if(!Qk){
+      free(Mk);
       return n_outside;
     }
   }
@@ -479,7 +622,7 @@ unsigned long c_grid3d(double *dout, unsigned long *nout, double *standarderror,
     for(i=0;i<grid_size;i++){
       if(nout[i] > 1){
 	// standard deviation of the sample distribution
-	standarderror[i] = pow(Qk[pos] / (nout[i] - 1), 0.5) / pow(nout[i], 0.5);
+	standarderror[i] = pow(Qk[i] / (nout[i] - 1), 0.5) / pow(nout[i], 0.5);
       }
     }
   }
@@ -494,6 +637,55 @@ unsigned long c_grid3d(double *dout, unsigned long *nout, double *standarderror,
   return n_outside;
 }
 
+unsigned long c_gridsums3d(double *dsum, double *dsumsq, unsigned long *nout, double *data, 
+			   double *grid_start, double *grid_stop, int max_data, int *n_grid){
+  // Add the sum, the sum of the squares and the number of the
+  // data points in each voxel to the grids dsum, dsumsq and nout.
+  // Grids of different parts of a data set can therefore be added.
+  int i;
+  double *data_ptr;
+
+  double pos_double[3];
+  double grid_len[3];
+  int grid_pos[3];
+  int pos = 0;
+  unsigned long n_outside = 0;
+	
+  for(i = 0;i < 3; i++){
+    grid_len[i] = grid_stop[i] - grid_start[i];
+  }
+	
+  data_ptr = data;
+  for(i = 0; i < max_data ; i++){
+    // Calculate the relative position in the grid. 
+    pos_double[0] = (data_ptr[0] - grid_start[0]) / grid_len[0];
+    pos_double[1] = (data_ptr[1] - grid_start[1]) / grid_len[1];
+    pos_double[2] = (data_ptr[2] - grid_start[2]) / grid_len[2];
+    if((pos_double[0] >= 0) && (pos_double[0] < 1) && 
+       (pos_double[1] >= 0) && (pos_double[1] < 1) &&
+       (pos_double[2] >= 0) && (pos_double[2] < 1)){
+      // Calculate the position in the grid
+      grid_pos[0] = (int)(pos_double[0] * n_grid[0]);
+      grid_pos[1] = (int)(pos_double[1] * n_grid[1]);
+      grid_pos[2] = (int)(pos_double[2] * n_grid[2]);
+      
+      pos =  grid_pos[0] * (n_grid[1] * n_grid[2]);
+      pos += grid_pos[1] * n_grid[2];
+      pos += grid_pos[2];
+
+      // Store the answer
+      dsum[pos] += data_ptr[3];
+      dsumsq[pos] += data_ptr[3] * data_ptr[3];
+      nout[pos] += 1;
+    } else {
+      n_outside++;
+    }
+    data_ptr += 4;
+  }
+	
+  return n_outside;
+}
+
 PyMODINIT_FUNC initctrans(void)  {
 	(void) Py_InitModule3("ctrans", _ctransMethods, _ctransDoc);
 	import_array();  // Must be present for NumPy.  Called first after above line.
@@ -34,7 +34,7 @@
 #endif
 
 #ifndef NTHREADS
-#defile NTHREADS 2
+#define NTHREADS 2
 #endif
 
 typedef double _float;
@@ -48,6 +48,8 @@ typedef struct {
   _float xPixSize;   // X Pixel Size (microns)
   _float yPixSize;   // Y Pixel Size (microns)
   _float dist;       // Sample - Detector distance. 
+  _float *delOffset; // Delta offset of each row (ySize values)
+  _float *gamOffset; // Gamma offset of each column (xSize values)
 } CCD;
 
 typedef struct {
@@ -63,15 +65,18 @@ typedef struct {
 } imageThreadData;
 
 void *processImageThread(void* ptr);
-int calcQTheta(_float* diffAngles, _float theta, _float mu, _float *qTheta, _int n, _float lambda);
+int calcQTheta(CCD *ccd, _float delCen, _float gamCen, _float theta, _float mu, _float *qTheta, _float lambda, _float *work);
 int calcQPhiFromQTheta(_float *qTheta, _int n, _float chi, _float phi);
-int calcDeltaGamma(_float *delgam, CCD *ccd, _float delCen, _float gamCen);
+int calcDeltaGammaOffsets(CCD *ccd);
 int matmulti(_float *val, int n, _float mat[][3], int skip);
-int calcHKLFromQPhi(_float *qPhi, _int n, _float mat[][3]);
+int calcPhiRotation(_float r[][3], _float chi, _float phi);
+int calcHKLFromQTheta(_float *qTheta, _int n, _float chi, _float phi, _float mat[][3]);
 
 unsigned long c_grid3d(double *dout, unsigned long *nout, double *sterr, double *data, double *grid_start, double *grid_stop, int max_data, int *n_grid, int norm_data);
+unsigned long c_gridsums3d(double *dsum, double *dsumsq, unsigned long *nout, double *data, double *grid_start, double *grid_stop, int max_data, int *n_grid);
 
 static PyObject* gridder_3D(PyObject *self, PyObject *args, PyObject *kwargs);
+static PyObject* gridder_3D_sums(PyObject *self, PyObject *args, PyObject *kwargs);
 static PyObject* ccdToQ(PyObject *self, PyObject *args, PyObject *kwargs);
 
 static char *_ctransDoc = \
@@ -80,6 +85,8 @@ static char *_ctransDoc = \
 static PyMethodDef _ctransMethods[] = {
   {"grid3d", (PyCFunction)gridder_3D, METH_VARARGS | METH_KEYWORDS, 
    "Grid the numpy.array object into a regular grid"},
+  {"gridsums3d", (PyCFunction)gridder_3D_sums, METH_VARARGS | METH_KEYWORDS, 
+   "Add the sum, sum of squares and number of the data in each voxel to existing grids"},
   {"ccdToQ", (PyCFunction)ccdToQ,  METH_VARARGS | METH_KEYWORDS, 
    "Convert CCD image coordinates into Q values"},
   {NULL, NULL, 0, NULL}     /* Sentinel - marks the end of this structure */
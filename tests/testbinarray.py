@@ -0,0 +1,24 @@
+import numpy as np
+from pyspec.ccd.utils import binArray
+
+def refBinArray(a, bins):
+    """Reference binning by summing each block in a loop"""
+    out = np.zeros((a.shape[0] // bins[0], a.shape[1] // bins[1]), dtype = a.dtype)
+    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            out[i, j] = a[i * bins[0]:(i + 1) * bins[0], 
+                          j * bins[1]:(j + 1) * bins[1]].sum()
+    return out
+
+def test(shape, bins):
+    a = np.random.rand(*shape)
+    b = binArray(a, bins)
+    r = refBinArray(a, bins)
+    print "shape = ", shape, "bins = ", bins, 
+    print "binned shape = ", b.shape,
+    print "OK" if (b.shape == r.shape) and np.allclose(b, r) else "FAILED"
+
+if __name__ == "__main__":
+    for shape in [(12, 12), (20, 30), (64, 48)]:
+        for bins in [(1, 1), (2, 2), (4, 2), (2, 3)]:
+            test(shape, bins)
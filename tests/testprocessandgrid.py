@@ -0,0 +1,51 @@
+import numpy as np
+from pyspec.ccd.transformations import FileProcessor, ImageProcessor
+
+def makeImageProcessor(nimages):
+    """Make an ImageProcessor for a synthetic set of random images"""
+    fp = FileProcessor()
+    fp.images = np.random.rand(nimages, 80, 100)
+
+    ip = ImageProcessor(fp)
+    ip.setDetectorProp(0.2, 0.2, 100, 80, 50.0, 40.0)
+    ip.setDetectorPos(300.0, 0.0)
+    ip.setFrameMode(1)
+
+    angles = np.zeros((nimages, 6))
+    angles[:,0] = np.linspace(20, 30, nimages)
+    angles[:,1] = angles[:,0] / 2
+    angles[:,2] = 90.0
+    ip.setSetSettings(1.5, angles, np.eye(3) * 2 * np.pi / 4.0)
+
+    return ip
+
+def compare(ip, ref, name):
+    """Compare the grid of ip with the reference grid ref
+
+    ref is a tuple of (gridData, gridOccu, gridStdErr, gridOut)"""
+    gridData, gridOccu, gridStdErr, gridOut = ref
+    print "%-30s" % name,
+    print "gridData", np.allclose(ip.gridData, gridData),
+    print "gridOccu", (ip.gridOccu == gridOccu).all(),
+    print "gridStdErr", np.allclose(ip.gridStdErr, gridStdErr),
+    print "gridOut", ip.gridOut == gridOut
+
+if __name__ == "__main__":
+    ip = makeImageProcessor(10)
+    ip.setGridSize(dQN = [20, 20, 20])
+    ip.process()
+
+    # Use a grid smaller than the set to have points outside
+    ip.setGridSize(Qmin = ip.Qmin * 0.9, Qmax = ip.Qmax * 0.9)
+    ip.processGrid()
+    ref = (ip.gridData, ip.gridOccu, ip.gridStdErr, ip.gridOut)
+
+    for chunkSize in [1, 3, 10, None]:
+        ip.processAndGrid(chunkSize = chunkSize)
+        compare(ip, ref, "processAndGrid(%s)" % chunkSize)
+
+    for n in [2, 3]:
+        ip.processToQ()
+        ip.setNumJobs(n)
+        ip.processGrid()
+        compare(ip, ref, "processGrid() with %d jobs" % n)